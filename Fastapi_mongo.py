@@ -9,35 +9,171 @@ from fastapi import (
     Header,
     Query,
 )
+import asyncio
+import functools
+import hmac
+import os
+import time
+import numpy as np
 import pandas as pd
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+from typing import Annotated
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 from bson import ObjectId
 from pydantic import BaseModel
-import math
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    JSONResponse,
+    ORJSONResponse,
+)
 from fastapi.staticfiles import StaticFiles
-from datetime import datetime
 
-app =FastAPI()
+app =FastAPI(default_response_class=ORJSONResponse)
+
+# Upper bound on documents materialized by a single list endpoint
+MAX_RESULTS = 10_000
+
+# Documents fetched per round-trip by list endpoint cursors
+CURSOR_BATCH_SIZE = 1_000
+
+# Connection pool settings shared by every request
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 200,
+    "minPoolSize": 20,
+    "maxIdleTimeMS": 60_000,
+    "serverSelectionTimeoutMS": 2_000,
+    "socketTimeoutMS": 10_000,
+    "retryWrites": True,
+    "compressors": "zstd,zlib",
+}
+
+# Request logs are buffered in memory and written in batches
+LOG_FLUSH_INTERVAL = 0.2
+LOG_BATCH_SIZE = 500
+LOG_QUEUE_SIZE = 10_000  # entries beyond this are dropped while Mongo is slow
+
+# Seconds that admin and stats responses are served from memory
+CACHE_TTL = 30
+
+# Rows per insert_many batch for CSV uploads; batches are sent concurrently
+CSV_CHUNK_SIZE = 5_000
+CSV_MAX_CONCURRENT_INSERTS = 4
+
+# Case-insensitive comparison for name prefix search
+NAME_COLLATION = {"locale": "en", "strength": 2}
+
+# Fields returned by the student endpoints
+STUDENT_PROJECTION = {
+    "_id": 0,
+    "student_id": 1,
+    "name": 1,
+    "age": 1,
+    "grade": 1,
+    "email": 1,
+}
 
 @app.on_event("startup")
-def startup_db_client():
+async def startup_db_client():
     global client, db
-    client = MongoClient("mongodb://localhost:27017")
+    client = AsyncIOMotorClient("mongodb://localhost:27017", **MONGO_CLIENT_OPTIONS)
     db = client["school_db"]
+    await db.students.create_index([("name", "text")])
+    await db.students.create_index(
+        [("name", 1)], collation=NAME_COLLATION, name="name_ci"
+    )
+    await db.students.create_index("grade")
+    try:
+        await db.students.create_index("student_id", unique=True)
+    except DuplicateKeyError:
+        print(" Duplicate student ids exist, students.student_id index not created.")
+    try:
+        await db.courses.create_index("course_id", unique=True)
+    except DuplicateKeyError:
+        print(" Duplicate course ids exist, courses.course_id index not created.")
+    try:
+        await db.enrollments.create_index(
+            [("student_id", 1), ("course_id", 1)], unique=True
+        )
+    except DuplicateKeyError:
+        print(
+            " Duplicate enrollments exist, enrollments (student_id, course_id)"
+            " index not created."
+        )
+    await db.enrollments.create_index("course_id")
+    await db.logs.create_index("ts_ns")
+    await seed_counter("student_id", db.students)
+    await seed_counter("course_id", db.courses)
+    app.state.log_q = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    app.state.log_stop = asyncio.Event()
+    app.state.log_drainer = asyncio.create_task(drain_logs())
     print(" Connected to MongoDB")
 
 
 @app.on_event("shutdown")
-def shutdown_db_client():
+async def shutdown_db_client():
     global client
+    app.state.log_stop.set()
+    await app.state.log_drainer
     if client:
         client.close()
         print(" MongoDB connection closed")
 
 
+async def flush_logs():
+    q = app.state.log_q
+    while not q.empty():
+        batch = [q.get_nowait() for _ in range(min(LOG_BATCH_SIZE, q.qsize()))]
+        try:
+            await db.logs.insert_many(batch, ordered=False)
+        except PyMongoError as exc:
+            # Stop at the first failure: the remaining batches would each wait
+            # out the server selection timeout. They stay queued for the next
+            # flush (or are dropped at shutdown).
+            print(f" Failed to write {len(batch)} request logs: {exc}")
+            return
+
+
+async def drain_logs():
+    # Runs until shutdown sets log_stop, then makes one last flush. Stopping
+    # through the event rather than cancel() never interrupts an insert_many
+    # whose batch has already left the queue.
+    stop = app.state.log_stop
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), LOG_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_logs()
+
+
+def ttl_cache(seconds):
+    # Cache an async endpoint's result per argument set for `seconds`
+    def decorator(func):
+        cache = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            hit = cache.get(key)
+            if hit and now - hit[0] < seconds:
+                return hit[1]
+            value = await func(*args, **kwargs)
+            # Evict expired entries so distinct arguments cannot pile up
+            for stale in [k for k, (t, _) in cache.items() if now - t >= seconds]:
+                del cache[stale]
+            cache[key] = (now, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
 # ---------- MODELS ----------
 class Student(BaseModel):
     student_id: int
@@ -57,35 +193,45 @@ class Enrollment(BaseModel):
     student_id: int
     course_id: int
 
-def fix_id(doc):
-    if doc and "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    return doc
+def clean_document(doc):
+    # v != v only holds for NaN; ObjectIds (including _id) become strings
+    return {
+        k: None if v != v else str(v) if type(v) is ObjectId else v
+        for k, v in doc.items()
+    }
 
 
-def clean_document(doc):
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    for k, v in doc.items():
-        if isinstance(v, float) and math.isnan(v):
-            doc[k] = None
-        elif isinstance(v, ObjectId):
-            doc[k] = str(v)
-    return doc
+async def advance_counter(name, value):
+    # $max only ever raises the counter, so ids at or below `value` are skipped
+    await db.counters.update_one({"_id": name}, {"$max": {"seq": value}}, upsert=True)
+
+
+async def seed_counter(name, collection):
+    # Raise the counter to the highest numeric id already stored. Non-numeric
+    # ids (e.g. "S001" from a CSV) are ignored; strings sort above numbers and
+    # would break $inc in next_sequence.
+    last = await collection.find_one(
+        {name: {"$type": "number"}}, sort=[(name, -1)], projection={name: 1}
+    )
+    await advance_counter(name, last[name] if last else 0)
+
+
+async def next_sequence(name):
+    counter = await db.counters.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"]
 
 
-def get_next_student_id():
-    last_student = db.students.find_one(sort=[("student_id", -1)])
-    if last_student:
-        return last_student["student_id"] + 1
-    return 1
+async def get_next_student_id():
+    return await next_sequence("student_id")
 
 
-def get_next_course_id():
-    last_course = db.courses.find_one(sort=[("course_id", -1)])
-    if last_course:
-        return last_course["course_id"] + 1
-    return 1
+async def get_next_course_id():
+    return await next_sequence("course_id")
 
 
 # ---------- ROOT ----------
@@ -100,95 +246,136 @@ def read_root():
 
 # ---------- STUDENTS ----------
 @app.post("/students")
-def create_student(student: Student):
+async def create_student(student: Student):
     student_dict = student.model_dump()
-    result = db.students.insert_one(student_dict)
+    # Reserve the client-supplied id before inserting so the counter never
+    # hands it out
+    await advance_counter("student_id", student.student_id)
+    result = await db.students.insert_one(student_dict)
     return {"inserted_id": str(result.inserted_id)}
 
 
 @app.get("/students")
-def get_students():
-    students = list(db.students.find())
-    return [clean_document(s) for s in students]
+async def get_students():
+    students = await (
+        db.students.find({}, STUDENT_PROJECTION)
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
+    )
+    return list(map(clean_document, students))
 
 
 @app.get("/students/search")
-def search_students(name: str):
-    students = list(db.students.find({"name": {"$regex": name, "$options": "i"}}))
-    return [clean_document(s) for s in students]
+async def search_students(name: str):
+    # A single token is matched as a name prefix, since the text index only
+    # matches whole tokens ("Wendy" would miss "Wendy3"). The prefix is a range
+    # under NAME_COLLATION, so it stays case-insensitive and uses name_ci
+    # ($regex ignores collation). Multi-word input goes through the text index.
+    name = name.strip()
+    if len(name.split()) <= 1:
+        students = await (
+            db.students.find(
+                {"name": {"$gte": name, "$lt": name + "\uffff"}}, STUDENT_PROJECTION
+            )
+            .collation(NAME_COLLATION)
+            .to_list(length=MAX_RESULTS)
+        )
+    else:
+        students = await (
+            db.students.find({"$text": {"$search": name}}, STUDENT_PROJECTION)
+            .sort([("score", {"$meta": "textScore"})])
+            .to_list(length=MAX_RESULTS)
+        )
+    return list(map(clean_document, students))
 
 
 @app.get("/students/paginated")
-def paginated_students(page: int = Query(1, ge=1), limit: int = Query(10, ge=1)):
-    skip = (page - 1) * limit
-    students = list(db.students.find().skip(skip).limit(limit))
-    return [clean_document(s) for s in students]
+async def paginated_students(
+    after_id: int = Query(None, description="Last student_id of the previous page"),
+    limit: int = Query(10, ge=1),
+):
+    query = {} if after_id is None else {"student_id": {"$gt": after_id}}
+    students = await (
+        db.students.find(query, STUDENT_PROJECTION)
+        .sort("student_id", 1)
+        .limit(limit)
+        .to_list(length=limit)
+    )
+    items = list(map(clean_document, students))
+    return {"items": items, "next": items[-1]["student_id"] if items else None}
 
 
 @app.get("/students/filter")
-def filter_students(
+async def filter_students(
     min_age: int = Query(0, ge=0, description="Minimum age filter"),
     sort: str = Query("asc", regex="^(asc|desc)$", description="Sort order (asc/desc)"),
 ):
     sort_order = 1 if sort == "asc" else -1
-    students = list(
-        db.students.find({"age": {"$gte": min_age}}).sort("age", sort_order)
+    students = await (
+        db.students.find({"age": {"$gte": min_age}}, STUDENT_PROJECTION)
+        .sort("age", sort_order)
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
     )
-    return [clean_document(s) for s in students]
+    return list(map(clean_document, students))
 
 #  Put HTML endpoint ABOVE the dynamic {student_id}
 @app.get("/students/html", response_class=HTMLResponse)
-def students_html(request: Request):
-    students = list(db.students.find())
+async def students_html(request: Request):
+    students = await db.students.find().to_list(length=MAX_RESULTS)
     return templates.TemplateResponse(
         "students_form.html", {"request": request, "students": students}
     )
 
 
 @app.get("/students/{student_id}")
-def get_student(student_id: int):
-    student = db.students.find_one({"student_id": student_id})
+async def get_student(student_id: int):
+    student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
-    return fix_id(student)
+    return clean_document(student)
 
 
 @app.put("/students/{student_id}")
-def update_student(student_id: int, student: Student):
+async def update_student(student_id: int, student: Student):
     update_data = student.model_dump(exclude_unset=True)
-    result = db.students.update_one({"student_id": student_id}, {"$set": update_data})
+    result = await db.students.update_one({"student_id": student_id}, {"$set": update_data})
     return {"updated_count": result.modified_count}
 
 
 @app.delete("/students/{student_id}")
-def delete_student(student_id: int):
-    enrollment = db.enrollments.find_one({"student_id": student_id})
+async def delete_student(student_id: int):
+    enrollment = await db.enrollments.find_one(
+        {"student_id": student_id}, {"_id": 1}
+    )
     if enrollment:
         return {
             "deleted_count": 0,
             "message": "Cannot delete student: already enrolled in a course",
         }
-    result = db.students.delete_one({"student_id": student_id})
+    result = await db.students.delete_one({"student_id": student_id})
     return {"deleted_count": result.deleted_count}
 
 
 # ---------- COURSES ----------
 @app.post("/courses")
-def create_course(course: Course):
+async def create_course(course: Course):
     course_doc = course.model_dump()
-    course_doc["course_id"] = get_next_course_id()
-    result = db.courses.insert_one(course_doc)
+    course_doc["course_id"] = await get_next_course_id()
+    result = await db.courses.insert_one(course_doc)
     return {"inserted_id": course_doc["course_id"]}
 
 
 @app.get("/courses")
-def get_courses():
-    courses = list(db.courses.find())
-    return [fix_id(c) for c in courses]
+async def get_courses():
+    courses = await (
+        db.courses.find().batch_size(CURSOR_BATCH_SIZE).to_list(length=MAX_RESULTS)
+    )
+    return list(map(clean_document, courses))
 
 
 @app.get("/courses/{course_id}/students")
-def get_students_in_course(course_id: int):
+async def get_students_in_course(course_id: int):
     pipeline = [
         {"$match": {"course_id": course_id}},
         {
@@ -196,31 +383,43 @@ def get_students_in_course(course_id: int):
                 "from": "students",
                 "localField": "student_id",
                 "foreignField": "student_id",
+                "pipeline": [{"$project": STUDENT_PROJECTION}],
                 "as": "student_info",
             }
         },
+        # $unwind directly after $lookup is coalesced into the lookup stage
         {"$unwind": "$student_info"},
-        {"$replaceRoot": {"newRoot": "$student_info"}},
+        {"$replaceWith": "$student_info"},
     ]
-    students = list(db.enrollments.aggregate(pipeline))
+    students = await db.enrollments.aggregate(pipeline).to_list(length=MAX_RESULTS)
     if not students:
         raise HTTPException(status_code=404, detail="No students found for this course")
-    return [fix_id(s) for s in students]
+    return list(map(clean_document, students))
 
 
 # ---------- STATS ----------
 @app.get("/stats/grades")
-def get_grade_stats():
-    pipeline = [{"$group": {"_id": "$grade", "count": {"$sum": 1}}}]
-    results = list(db.students.aggregate(pipeline))
+@ttl_cache(CACHE_TTL)
+async def get_grade_stats():
+    # Sorting on the indexed field lets $group read grades off the index
+    pipeline = [
+        {"$sort": {"grade": 1}},
+        {"$group": {"_id": "$grade", "count": {"$sum": 1}}},
+    ]
+    results = await db.students.aggregate(pipeline, hint=[("grade", 1)]).to_list(
+        length=None
+    )
     return {r["_id"]: r["count"] for r in results if r["_id"]}
 
 
 @app.get("/stats/top-courses")
-def get_top_courses():
+@ttl_cache(CACHE_TTL)
+async def get_top_courses(limit: int = Query(10, ge=1, le=100)):
+    # Limit before the $lookup so only the top courses are joined
     pipeline = [
         {"$group": {"_id": "$course_id", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
+        {"$limit": limit},
         {
             "$lookup": {
                 "from": "courses",
@@ -229,7 +428,8 @@ def get_top_courses():
                 "as": "course_info",
             }
         },
-        {"$unwind": "$course_info"},
+        # Keep enrollments whose course doc is missing so `limit` rows come back
+        {"$unwind": {"path": "$course_info", "preserveNullAndEmptyArrays": True}},
         {
             "$project": {
                 "_id": 0,
@@ -239,39 +439,107 @@ def get_top_courses():
             }
         },
     ]
-    return list(db.enrollments.aggregate(pipeline))
+    return await db.enrollments.aggregate(pipeline).to_list(length=limit)
 
 @app.post("/enrollments")
-def enroll_student(enrollment: Enrollment):
-    if not db.students.find_one({"student_id": enrollment.student_id}):
+async def enroll_student(enrollment: Enrollment):
+    # Validate both references in a single round-trip
+    pipeline = [
+        {
+            "$documents": [
+                {"sid": enrollment.student_id, "cid": enrollment.course_id}
+            ]
+        },
+        {
+            "$lookup": {
+                "from": "students",
+                "localField": "sid",
+                "foreignField": "student_id",
+                "pipeline": [{"$project": {"_id": 1}}],
+                "as": "s",
+            }
+        },
+        {
+            "$lookup": {
+                "from": "courses",
+                "localField": "cid",
+                "foreignField": "course_id",
+                "pipeline": [{"$project": {"_id": 1}}],
+                "as": "c",
+            }
+        },
+        {
+            "$project": {
+                "student_ok": {"$gt": [{"$size": "$s"}, 0]},
+                "course_ok": {"$gt": [{"$size": "$c"}, 0]},
+            }
+        },
+    ]
+    check = (await db.aggregate(pipeline).to_list(length=1))[0]
+    if not check["student_ok"]:
         raise HTTPException(status_code=404, detail="Student not found")
-    if not db.courses.find_one({"course_id": enrollment.course_id}):
+    if not check["course_ok"]:
         raise HTTPException(status_code=404, detail="Course not found")
     enrollment_doc = enrollment.model_dump()
-    result = db.enrollments.insert_one(enrollment_doc)
+    result = await db.enrollments.insert_one(enrollment_doc)
     return {"inserted_id": str(result.inserted_id)}
 
 
 @app.get("/enrollments")
-def get_enrollments():
-    enrollments = list(db.enrollments.find())
-    return [fix_id(e) for e in enrollments]
+async def get_enrollments():
+    enrollments = await (
+        db.enrollments.find()
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
+    )
+    return list(map(clean_document, enrollments))
 
 
 # ---------- DATABASES ----------
 @app.get("/databases")
-def list_databases():
-    return {"databases": client.list_database_names()}
+@ttl_cache(CACHE_TTL)
+async def list_databases():
+    return {"databases": await client.list_database_names()}
 
 
 # ---------- UPLOAD CSV ----------
+async def insert_students_chunk(df, start, semaphore):
+    # Rows become dicts only once a slot is free, so at most
+    # CSV_MAX_CONCURRENT_INSERTS chunks are materialized at a time
+    async with semaphore:
+        records = await run_in_threadpool(
+            df.iloc[start : start + CSV_CHUNK_SIZE].to_dict, orient="records"
+        )
+        try:
+            result = await db.students.insert_many(records, ordered=False)
+            return len(result.inserted_ids)
+        except BulkWriteError as exc:
+            # Rows rejected as duplicates (code 11000) are skipped and the rest
+            # kept; any other write or write-concern error fails the upload
+            details = exc.details
+            if details.get("writeConcernErrors") or any(
+                err["code"] != 11000 for err in details.get("writeErrors", [])
+            ):
+                raise
+            return details["nInserted"]
+
+
 @app.post("/upload-csv")
 async def upload_csv(file: UploadFile = File(...)):
-    df = pd.read_csv(file.file)
-    records = df.to_dict(orient="records")
-    if records:
-        db.students.insert_many(records)
-    return {"inserted_count": len(records)}
+    # Parsing and record conversion are CPU-bound; keep them off the event loop
+    df = await run_in_threadpool(
+        lambda: pd.read_csv(file.file).replace({np.nan: None})
+    )
+    semaphore = asyncio.Semaphore(CSV_MAX_CONCURRENT_INSERTS)
+    counts = await asyncio.gather(
+        *(
+            insert_students_chunk(df, start, semaphore)
+            for start in range(0, len(df), CSV_CHUNK_SIZE)
+        )
+    )
+    inserted = sum(counts)
+    await seed_counter("student_id", db.students)
+    return {"inserted_count": inserted}
 
 
 # ---------- FORM ----------
@@ -282,32 +550,42 @@ def student_form(request: Request):
 
 
 @app.post("/form/student")
-def submit_student(
+async def submit_student(
     name: str = Form(...),
     age: int = Form(...),
     grade: str = Form(...),
     email: str = Form(...),
 ):
     student = {
-        "student_id": get_next_student_id(),
+        "student_id": await get_next_student_id(),
         "name": name,
         "age": age,
         "grade": grade,
         "email": email,
     }
-    db.students.insert_one(student)
+    await db.students.insert_one(student)
     return RedirectResponse(url="/students", status_code=303)
 
 
-def verify_api_key(x_api_key: str = Header(...)):
-    if x_api_key != API_KEY:
+# Secure routes reject every request while API_KEY is unset
+API_KEY = os.environ.get("API_KEY")
+_API_KEY_BYTES = API_KEY.encode() if API_KEY else None
+
+
+def verify_api_key(x_api_key: Annotated[str, Header()]):
+    # Constant-time comparison so response timing does not leak the key
+    if _API_KEY_BYTES is None or not hmac.compare_digest(
+        x_api_key.encode(), _API_KEY_BYTES
+    ):
         raise HTTPException(status_code=401, detail="Invalid or missing API Key")
 
 
 # Example secure route
 @app.get("/secure/students", dependencies=[Depends(verify_api_key)])
-def secure_get_students():
-    students = list(db.students.find({}, {"_id": 0}))
+async def secure_get_students():
+    students = await db.students.find({}, STUDENT_PROJECTION).to_list(
+        length=MAX_RESULTS
+    )
     return students
 
 
@@ -316,9 +594,12 @@ async def log_requests(request: Request, call_next):
     log_entry = {
         "method": request.method,
         "path": request.url.path,
-        "timestamp": datetime.utcnow(),
+        "ts_ns": time.time_ns(),
     }
-    db.logs.insert_one(log_entry)  # save log in MongoDB
+    try:
+        app.state.log_q.put_nowait(log_entry)  # saved to MongoDB by drain_logs
+    except asyncio.QueueFull:
+        pass
 
     response = await call_next(request)
     return response
@@ -1,26 +1,173 @@
 from fastapi import FastAPI, HTTPException, Depends, Request, Query, Form
-from fastapi.responses import JSONResponse, StreamingResponse, HTMLResponse
+from fastapi.responses import (
+    JSONResponse,
+    ORJSONResponse,
+    StreamingResponse,
+    HTMLResponse,
+)
+from fastapi.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from fastapi.security.api_key import APIKeyHeader
-from pymongo import MongoClient, errors
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, errors
 from pydantic import BaseModel
 from bson import ObjectId
+import numpy as np
 import pandas as pd
+import asyncio
+import functools
+import hmac
+import time
 import io
-from datetime import datetime
+from typing import Annotated
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 
-client = MongoClient("mongodb://localhost:27017/")
+# Connection pool settings shared by every request
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": 200,
+    "minPoolSize": 20,
+    "maxIdleTimeMS": 60_000,
+    "serverSelectionTimeoutMS": 2_000,
+    "socketTimeoutMS": 10_000,
+    "retryWrites": True,
+    "compressors": "zstd,zlib",
+}
+
+client = AsyncIOMotorClient("mongodb://localhost:27017/", **MONGO_CLIENT_OPTIONS)
 db = client["fastapi_db"]
 
-# Handle unique index creation safely
-try:
-    db.students.create_index("email", unique=True)
-except errors.DuplicateKeyError:
-    print("⚠️ Duplicate emails exist, index not created. Clean data before retrying.")
+# Upper bound on documents materialized by a single list endpoint
+MAX_RESULTS = 10_000
+
+# Documents fetched per round-trip by list endpoint cursors
+CURSOR_BATCH_SIZE = 1_000
+
+# Request logs are buffered in memory and written in batches
+LOG_FLUSH_INTERVAL = 0.2
+LOG_BATCH_SIZE = 500
+LOG_QUEUE_SIZE = 10_000  # entries beyond this are dropped while Mongo is slow
+
+# Seconds that stats responses are served from memory
+CACHE_TTL = 30
+
+# Rows per insert_many batch for CSV uploads; batches are sent concurrently
+CSV_CHUNK_SIZE = 5_000
+CSV_MAX_CONCURRENT_INSERTS = 4
+
+# Documents per CSV chunk streamed by /students/export
+EXPORT_BATCH_SIZE = 5_000
+
+# Fields returned by the student endpoints
+STUDENT_PROJECTION = {
+    "_id": 0,
+    "student_id": 1,
+    "name": 1,
+    "age": 1,
+    "grade": 1,
+    "email": 1,
+}
+
+
+@app.on_event("startup")
+async def create_indexes():
+    # Handle unique index creation safely
+    try:
+        await db.students.create_index("email", unique=True)
+    except errors.DuplicateKeyError:
+        print("⚠️ Duplicate emails exist, index not created. Clean data before retrying.")
+
+    try:
+        await db.students.create_index("student_id", unique=True)
+    except errors.DuplicateKeyError:
+        print("⚠️ Duplicate student ids exist, students.student_id index not created.")
+
+    try:
+        await db.courses.create_index("course_id", unique=True)
+    except errors.DuplicateKeyError:
+        print("⚠️ Duplicate course ids exist, courses.course_id index not created.")
+
+    try:
+        await db.enrollments.create_index(
+            [("student_id", 1), ("course_id", 1)], unique=True
+        )
+    except errors.DuplicateKeyError:
+        print(
+            "⚠️ Duplicate enrollments exist, enrollments (student_id, course_id)"
+            " index not created."
+        )
+    await db.enrollments.create_index("course_id")
+    await db.students.create_index("grade")
+    await db.logs.create_index("ts_ns")
+    await seed_counter("student_id", db.students)
+
+
+async def advance_counter(name, value):
+    # $max only ever raises the counter, so ids at or below `value` are skipped
+    await db.counters.update_one({"_id": name}, {"$max": {"seq": value}}, upsert=True)
+
+
+async def seed_counter(name, collection):
+    # Raise the counter to the highest numeric id already stored. Non-numeric
+    # ids (e.g. "S001" from a CSV) are ignored; strings sort above numbers and
+    # would break $inc in next_sequence.
+    last = await collection.find_one(
+        {name: {"$type": "number"}}, sort=[(name, -1)], projection={name: 1}
+    )
+    await advance_counter(name, last[name] if last else 0)
+
+
+async def next_sequence(name):
+    counter = await db.counters.find_one_and_update(
+        {"_id": name},
+        {"$inc": {"seq": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return counter["seq"]
+
+
+@app.on_event("startup")
+async def start_log_drainer():
+    app.state.log_q = asyncio.Queue(maxsize=LOG_QUEUE_SIZE)
+    app.state.log_stop = asyncio.Event()
+    app.state.log_drainer = asyncio.create_task(drain_logs())
+
+
+@app.on_event("shutdown")
+async def stop_log_drainer():
+    app.state.log_stop.set()
+    await app.state.log_drainer
+    client.close()
+
+
+async def flush_logs():
+    q = app.state.log_q
+    while not q.empty():
+        batch = [q.get_nowait() for _ in range(min(LOG_BATCH_SIZE, q.qsize()))]
+        try:
+            await db.logs.insert_many(batch, ordered=False)
+        except errors.PyMongoError as exc:
+            # Stop at the first failure: the remaining batches would each wait
+            # out the server selection timeout. They stay queued for the next
+            # flush (or are dropped at shutdown).
+            print(f"⚠️ Failed to write {len(batch)} request logs: {exc}")
+            return
+
+
+async def drain_logs():
+    # Runs until shutdown sets log_stop, then makes one last flush. Stopping
+    # through the event rather than cancel() never interrupts an insert_many
+    # whose batch has already left the queue.
+    stop = app.state.log_stop
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), LOG_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        await flush_logs()
 
 
 def clean_document(doc):
@@ -29,6 +176,30 @@ def clean_document(doc):
     return doc
 
 
+def ttl_cache(seconds):
+    # Cache an async endpoint's result per argument set for `seconds`
+    def decorator(func):
+        cache = {}
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+            hit = cache.get(key)
+            if hit and now - hit[0] < seconds:
+                return hit[1]
+            value = await func(*args, **kwargs)
+            # Evict expired entries so distinct arguments cannot pile up
+            for stale in [k for k, (t, _) in cache.items() if now - t >= seconds]:
+                del cache[stale]
+            cache[key] = (now, value)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
 class Student(BaseModel):
     student_id: int
     name: str
@@ -48,117 +219,197 @@ class Enrollment(BaseModel):
 
 
 @app.post("/students")
-def create_student(student: Student):
+async def create_student(student: Student):
+    # Reserve the client-supplied id before inserting so the counter never
+    # hands it out
+    await advance_counter("student_id", student.student_id)
     try:
-        result = db.students.insert_one(student.model_dump())
-        return {"inserted_id": str(result.inserted_id)}
-    except errors.DuplicateKeyError:
-        return JSONResponse(status_code=409, content={"detail": "Email already exists"})
+        result = await db.students.insert_one(student.model_dump())
+    except errors.DuplicateKeyError as exc:
+        # email and student_id are both unique; name the one that collided
+        field = next(iter((exc.details or {}).get("keyPattern", {})), "key")
+        return JSONResponse(
+            status_code=409,
+            content={"detail": f"A student with this {field} already exists"},
+        )
+    return {"inserted_id": str(result.inserted_id)}
 
 
 @app.get("/students")
-def get_students():
-    students = list(db.students.find())
-    return [clean_document(s) for s in students]
+async def get_students():
+    return await (
+        db.students.find({}, STUDENT_PROJECTION)
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
+    )
 
 
 @app.get("/students/paginated")
-def paginated_students(page: int = Query(1, ge=1), limit: int = Query(10, ge=1)):
-    skip = (page - 1) * limit
-    students = list(db.students.find().skip(skip).limit(limit))
-    return [clean_document(s) for s in students]
+async def paginated_students(
+    after_id: int = Query(None, description="Last student_id of the previous page"),
+    limit: int = Query(10, ge=1),
+):
+    query = {} if after_id is None else {"student_id": {"$gt": after_id}}
+    items = await (
+        db.students.find(query, STUDENT_PROJECTION)
+        .sort("student_id", 1)
+        .limit(limit)
+        .to_list(length=limit)
+    )
+    return {"items": items, "next": items[-1]["student_id"] if items else None}
 
 
 @app.get("/students/filter")
-def filter_students(
+async def filter_students(
     min_age: int = Query(0, ge=0, description="Minimum age filter"),
     sort: str = Query(
         "asc", pattern="^(asc|desc)$", description="Sort order (asc/desc)"
     ),
 ):
     sort_order = 1 if sort == "asc" else -1
-    students = list(
-        db.students.find({"age": {"$gte": min_age}}).sort("age", sort_order)
+    return await (
+        db.students.find({"age": {"$gte": min_age}}, STUDENT_PROJECTION)
+        .sort("age", sort_order)
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
     )
-    return [clean_document(s) for s in students]
+
+
+# Static /students/... routes must come before the dynamic {student_id}
+@app.get("/students/export")
+async def export_students():
+    # A fixed schema keeps every batch aligned with the header, whatever
+    # fields the first documents happen to have
+    columns = ["_id", *Student.model_fields]
+
+    async def generate():
+        # Each batch is written as soon as it arrives, with the header only once
+        header = True
+        cursor = db.students.find(
+            {}, dict.fromkeys(columns, 1), batch_size=EXPORT_BATCH_SIZE
+        )
+        while batch := await cursor.to_list(length=EXPORT_BATCH_SIZE):
+            df = pd.DataFrame(batch, columns=columns)
+            df["_id"] = df["_id"].astype(str)
+            yield df.to_csv(index=False, header=header)
+            header = False
+
+    response = StreamingResponse(generate(), media_type="text/csv")
+    response.headers["Content-Disposition"] = "attachment; filename=students.csv"
+    return response
 
 
 @app.get("/students/{student_id}")
-def get_student(student_id: int):
-    student = db.students.find_one({"student_id": student_id})
-    return clean_document(student) if student else {"detail": "Not found"}
+async def get_student(student_id: int):
+    student = await db.students.find_one({"student_id": student_id}, {"_id": 0})
+    return student if student else {"detail": "Not found"}
 
 
 @app.put("/students/{student_id}")
-def update_student(student_id: int, student: Student):
+async def update_student(student_id: int, student: Student):
     update_data = student.model_dump(exclude_unset=True)
-    db.students.update_one({"student_id": student_id}, {"$set": update_data})
+    await db.students.update_one({"student_id": student_id}, {"$set": update_data})
     return {"message": "Student updated"}
 
 
 @app.delete("/students/{student_id}")
-def delete_student(student_id: int):
-    if db.enrollments.find_one({"student_id": student_id}):
+async def delete_student(student_id: int):
+    if await db.enrollments.find_one({"student_id": student_id}, {"_id": 1}):
         return {"detail": "Student is enrolled in a course"}
-    db.students.delete_one({"student_id": student_id})
+    await db.students.delete_one({"student_id": student_id})
     return {"message": "Student deleted"}
 
 
 @app.post("/courses")
-def create_course(course: Course):
-    result = db.courses.insert_one(course.model_dump())
+async def create_course(course: Course):
+    result = await db.courses.insert_one(course.model_dump())
     return {"inserted_id": str(result.inserted_id)}
 
 
 @app.get("/courses")
-def get_courses():
-    return [clean_document(c) for c in db.courses.find()]
+async def get_courses():
+    courses = await (
+        db.courses.find().batch_size(CURSOR_BATCH_SIZE).to_list(length=MAX_RESULTS)
+    )
+    return [clean_document(c) for c in courses]
 
 
 @app.post("/enrollments")
-def enroll_student(enrollment: Enrollment):
-    result = db.enrollments.insert_one(enrollment.model_dump())
+async def enroll_student(enrollment: Enrollment):
+    result = await db.enrollments.insert_one(enrollment.model_dump())
     return {"inserted_id": str(result.inserted_id)}
 
 
 @app.get("/enrollments")
-def get_enrollments():
-    return [clean_document(e) for e in db.enrollments.find()]
+async def get_enrollments():
+    enrollments = await (
+        db.enrollments.find()
+        .batch_size(CURSOR_BATCH_SIZE)
+        .to_list(length=MAX_RESULTS)
+    )
+    return [clean_document(e) for e in enrollments]
 
 
 @app.get("/stats/grades")
-def grade_stats():
-    pipeline = [{"$group": {"_id": "$grade", "count": {"$sum": 1}}}]
-    result = {doc["_id"]: doc["count"] for doc in db.students.aggregate(pipeline)}
+@ttl_cache(CACHE_TTL)
+async def grade_stats():
+    # Sorting on the indexed field lets $group read grades off the index
+    pipeline = [
+        {"$sort": {"grade": 1}},
+        {"$group": {"_id": "$grade", "count": {"$sum": 1}}},
+    ]
+    cursor = db.students.aggregate(pipeline, hint=[("grade", 1)])
+    result = {doc["_id"]: doc["count"] async for doc in cursor}
     return result
 
 
 @app.get("/stats/top-courses")
-def top_courses():
+@ttl_cache(CACHE_TTL)
+async def top_courses():
     pipeline = [
         {"$group": {"_id": "$course_id", "count": {"$sum": 1}}},
         {"$sort": {"count": -1}},
     ]
-    return list(db.enrollments.aggregate(pipeline))
+    return await db.enrollments.aggregate(pipeline).to_list(length=MAX_RESULTS)
+
+
+async def insert_students_chunk(df, start, semaphore):
+    # Rows become dicts only once a slot is free, so at most
+    # CSV_MAX_CONCURRENT_INSERTS chunks are materialized at a time
+    async with semaphore:
+        records = await run_in_threadpool(
+            df.iloc[start : start + CSV_CHUNK_SIZE].to_dict, orient="records"
+        )
+        try:
+            result = await db.students.insert_many(records, ordered=False)
+            return len(result.inserted_ids)
+        except errors.BulkWriteError as exc:
+            # Rows rejected as duplicates (code 11000) are skipped and the rest
+            # kept; any other write or write-concern error fails the upload
+            details = exc.details
+            if details.get("writeConcernErrors") or any(
+                err["code"] != 11000 for err in details.get("writeErrors", [])
+            ):
+                raise
+            return details["nInserted"]
 
 
 @app.post("/upload-csv")
 async def upload_csv(file: bytes):
-    df = pd.read_csv(io.BytesIO(file))
-    db.students.insert_many(df.to_dict(orient="records"))
-    return {"message": "CSV uploaded successfully"}
-
-
-@app.get("/students/export")
-def export_students():
-    students = list(db.students.find())
-    df = pd.DataFrame(students)
-    df["_id"] = df["_id"].astype(str)
-    stream = io.StringIO()
-    df.to_csv(stream, index=False)
-    response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=students.csv"
-    return response
+    # Parsing and record conversion are CPU-bound; keep them off the event loop
+    df = await run_in_threadpool(
+        lambda: pd.read_csv(io.BytesIO(file)).replace({np.nan: None})
+    )
+    semaphore = asyncio.Semaphore(CSV_MAX_CONCURRENT_INSERTS)
+    counts = await asyncio.gather(
+        *(
+            insert_students_chunk(df, start, semaphore)
+            for start in range(0, len(df), CSV_CHUNK_SIZE)
+        )
+    )
+    inserted = sum(counts)
+    await seed_counter("student_id", db.students)
+    return {"message": "CSV uploaded successfully", "inserted_count": inserted}
 
 
 templates = Jinja2Templates(directory="templates")
@@ -170,28 +421,32 @@ def student_form(request: Request):
 
 
 @app.post("/students/form")
-def submit_form(
+async def submit_form(
     name: str = Form(...),
     age: int = Form(...),
     grade: str = Form(...),
     email: str = Form(...),
 ):
     student = {
-        "student_id": int(datetime.now().timestamp()),
+        "student_id": await next_sequence("student_id"),
         "name": name,
         "age": age,
         "grade": grade,
         "email": email,
     }
-    db.students.insert_one(student)
+    await db.students.insert_one(student)
     return {"message": "Student added from form"}
 
 
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
+_API_KEY_BYTES = b"secret123"
 
 
-def verify_api_key(x_api_key: str = Depends(api_key_header)):
-    if x_api_key != "secret123":
+def verify_api_key(x_api_key: Annotated[str | None, Depends(api_key_header)]):
+    # Constant-time comparison so response timing does not leak the key
+    if x_api_key is None or not hmac.compare_digest(
+        x_api_key.encode(), _API_KEY_BYTES
+    ):
         raise HTTPException(status_code=403, detail="Forbidden")
     return x_api_key
 
@@ -203,13 +458,16 @@ def secure_data(api_key: str = Depends(verify_api_key)):
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    db.logs.insert_one(
-        {
-            "method": request.method,
-            "path": request.url.path,
-            "timestamp": datetime.utcnow(),
-        }
-    )
+    try:
+        app.state.log_q.put_nowait(
+            {
+                "method": request.method,
+                "path": request.url.path,
+                "ts_ns": time.time_ns(),
+            }
+        )
+    except asyncio.QueueFull:
+        pass
     response = await call_next(request)
     return response
 
@@ -219,3 +477,13 @@ def welcome(name: str = Query(None)):
     if not name:
         return {"message": "Hello, guest!"}
     return {"message": f"Welcome back, {name}!"}
+
+
+@app.exception_handler(errors.DuplicateKeyError)
+async def duplicate_key_handler(request: Request, exc: errors.DuplicateKeyError):
+    return JSONResponse(
+        status_code=409,
+        content={
+            "error": "Duplicate key error. A record with this value already exists."
+        },
+    )